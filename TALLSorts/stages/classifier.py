@@ -75,6 +75,10 @@ class Classifier(BaseEstimator, ClassifierMixin):
 
         self.subtypeObjects = reconstructSubtypeObj(tallsorts_model_dict)
 
+        # precomputed children index so per-level lookups don't rescan every subtype
+        self.level1_labels = sorted([i for i in self.subtypeObjects if self.subtypeObjects[i].level == 1])
+        self.children_map = {label: [c.label for c in self.subtypeObjects[label].children] for label in self.subtypeObjects}
+
         if labelThreshDict is None:
             self.labelThreshDict = {i:0.5 for i in self.hierarchy}
         else:
@@ -86,7 +90,7 @@ class Classifier(BaseEstimator, ClassifierMixin):
     def fit(self, X, y):
         return self
 
-    def predict(self, X):
+    def predict(self, X, norm_factors=None):
         """
         Runs the classifiers on a sample matrix X
 
@@ -94,6 +98,10 @@ class Classifier(BaseEstimator, ClassifierMixin):
         __________
         X : DataFrame
             Contains standardised logCPM gene counts, with genes as columns and samples as rows
+        norm_factors : Series
+            Optional precomputed TMM norm factors indexed by sample. Supplied when a
+            cohort is predicted in chunks so normalisation reflects the full cohort
+            rather than the chunk.
 
         Returns
         __________
@@ -126,7 +134,8 @@ class Classifier(BaseEstimator, ClassifierMixin):
 
                 # narrowing down only to the samples of interest at this level
                 if level == 1:
-                    X_test = X.copy()
+                    # no copy needed: X_test is only read, and scaleForTesting returns fresh output
+                    X_test = X
                 else:
                     parent = self.subtypeObjects[parent_label]
                     prev_level = f'Level_{level-1}_{parent.parent.label}' if level > 2 else 'Level_1_Level0'
@@ -144,7 +153,7 @@ class Classifier(BaseEstimator, ClassifierMixin):
                 for label_test in [i for i in self.hierarchy if self.hierarchy[i][1] == level]:
                     print(f'Testing {label_test}...')
 
-                    X_scaled = scaleForTesting(X_test, self.scalers[parent_label])
+                    X_scaled = scaleForTesting(X_test, self.scalers[parent_label], norm_factors=norm_factors)
                     label_test_results = self.runTest(X_scaled, self.clfs[label_test]) # this is where the test is run
 
                     probs_raw_df[label_test] = [i[1] for i in label_test_results['proba']]
@@ -28,15 +28,25 @@ pass
 Functions
 ---------------------------------------------------------------------------------------------------------------------'''
 
-def apply_TMM_CPM(X_raw):
+def computeNormFactors(X_raw):
+    # TMM norm factors for a cohort (samples as rows). These depend on the
+    # composition of the batch they are computed from, so when a cohort is
+    # processed in chunks they should be computed once on the full cohort and
+    # passed down to scaleForTesting.
+    return conorm.tmm_norm_factors(X_raw.transpose())
+
+def apply_TMM_CPM(X_raw, norm_factors=None):
     # Applying TMM then CPM normalisation
-    nf = conorm.tmm_norm_factors(X_raw.transpose())
-    X_cpm = conorm.cpm(X_raw.transpose(), norm_factors=nf).transpose()
+    if norm_factors is None:
+        norm_factors = computeNormFactors(X_raw)
+    else:
+        norm_factors = norm_factors.loc[X_raw.index]
+    X_cpm = conorm.cpm(X_raw.transpose(), norm_factors=norm_factors).transpose()
     X_logcpm = np.log2(X_cpm + 0.5)
     return X_logcpm
 
-def scaleForTesting(X_raw, scaler):
-    X_logcpm = apply_TMM_CPM(X_raw)
+def scaleForTesting(X_raw, scaler, norm_factors=None):
+    X_logcpm = apply_TMM_CPM(X_raw, norm_factors=norm_factors)
 
     # # set up scaler values
     scalerVals = {scaler.feature_names_in_[i]:[scaler.mean_[i], scaler.scale_[i]] for i in range(scaler.n_features_in_)}
@@ -29,12 +29,21 @@ import numpy as np
 import plotly.graph_objects as go
 import sys
 import gzip
+import io
 import pickle
-import csv
 import os
-import conorm
+import shutil
+import tempfile
 
 
+# if the Intel Extension for Scikit-learn is installed, patch LogisticRegression so fits
+# dispatch to the multithreaded oneDAL implementation; a no-op otherwise
+try:
+    from sklearnex import patch_sklearn
+    patch_sklearn(['LogisticRegression'])
+except ImportError:
+    pass
+
 from sklearn.linear_model import LogisticRegression
 from sklearn.preprocessing import StandardScaler
 from joblib import Parallel, delayed, parallel_backend  
@@ -43,7 +52,7 @@ from joblib import Parallel, delayed, parallel_backend
 from TALLSorts.common import message, root_dir, create_dir
 from TALLSorts.user import UserInput
 from TALLSorts.stages.subtype_class import SubtypeClass, reconstructSubtypeObj, genSubtypeObjsFromHierarchy, gen_hierarchy_dict
-from TALLSorts.stages.scaling import scaleForTesting, createScaler
+from TALLSorts.stages.scaling import scaleForTesting, createScaler, computeNormFactors
 from TALLSorts.stages.classifier import Classifier
 from TALLSorts.pipeline import TALLSorts
 
@@ -84,8 +93,12 @@ def run(ui=False):
     # determining if we need to re-label gene labels
     if ui.gene_labels == 'symbol':
         ensembl_relabel = convert_symbols_to_ensembl(ui.samples.columns)
-        ui.samples = ui.samples.drop(ensembl_relabel['unconfirmed'], axis=1)
-        ui.samples.columns = [ensembl_relabel['confirmed'][i] for i in ui.samples.columns]
+        confirmed = ensembl_relabel['confirmed']
+        # select the confirmed columns directly; drop() materializes a full copy of
+        # the frame before the rename touches it again
+        keep_cols = [i for i in ui.samples.columns if i in confirmed]
+        ui.samples = ui.samples[keep_cols]
+        ui.samples.columns = [confirmed[i] for i in keep_cols]
 
     # filling in NaN all columns
     ui.samples = ui.samples.fillna(0)
@@ -106,7 +119,8 @@ def load_classifier(path=False):
     Parameters
     __________
     path : str
-        Path to a pickle object that holds the TALLSorts model.
+        Path to a pickle object that holds the TALLSorts model. Can be gzip (.pkl.gz)
+        or zstd (.pkl.zst) compressed, or an uncompressed pickle (.pkl).
         Default: "/models/tallsorts/tallsorts.pkl.gz"
 
     Returns
@@ -117,10 +131,28 @@ def load_classifier(path=False):
 
     if not path:
         path = str(root_dir()) + "/models/tallsorts/tallsorts_default_model.pkl.gz"
-
-    message("Loading classifier...")
-    with gzip.open(path, 'rb') as f:
-        tallsorts = pickle.load(f)
+        # gzip decompression is slow and single-threaded; prefer an uncompressed or
+        # zstd-compressed sibling of the bundled default model when one exists.
+        # Only the default path gets this lookup — a user-supplied path is loaded
+        # exactly as given.
+        for alt_path in (path[:-3], path[:-3] + '.zst'):
+            if os.path.exists(alt_path):
+                path = alt_path
+                break
+
+    message(f"Loading classifier ({path})...")
+    if path.endswith('.zst'):
+        import zstandard as zstd
+        with open(path, 'rb') as f:
+            # BufferedReader gives the unpickler the readline support the raw zstd
+            # stream lacks, and batches its many small reads
+            tallsorts = pickle.load(io.BufferedReader(zstd.ZstdDecompressor().stream_reader(f)))
+    elif path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            tallsorts = pickle.load(f)
+    else:
+        with open(path, 'rb') as f:
+            tallsorts = pickle.load(f)
     return tallsorts
 
 def run_predictions(ui, tallsorts):
@@ -147,13 +179,16 @@ def run_predictions(ui, tallsorts):
     """
 
     # running the classifier
-    results = tallsorts.predict(ui.samples)
+    results = run_chunked_predict(tallsorts, ui.samples)
 
     # writing the probabilities to a CSV
     for level in [level for level in results.levels if len(results.levels[level]) > 0]:
         level_cleaned = clean_label(level)
         create_dir(f'{ui.destination}/{level_cleaned}')
-        results.levels[level]['probs_raw_df'].round(3).to_csv(f'{ui.destination}/{level_cleaned}/probabilities.csv', index_label='Sample')
+        # float_format avoids materializing a rounded copy of the probabilities;
+        # the large write buffer keeps syscall overhead down
+        with open(f'{ui.destination}/{level_cleaned}/probabilities.csv', 'w', buffering=1<<20, newline='') as f:
+            results.levels[level]['probs_raw_df'].to_csv(f, index_label='Sample', float_format='%.3f')
 
         # writing the highest predictions to a CSV
         pred_csv = results.levels[level]['calls_df'][["y_pred"]].copy()
@@ -171,7 +206,7 @@ def run_predictions(ui, tallsorts):
 
         get_figures(results_level=results.levels[level], 
                     destination=f'{ui.destination}/{level_cleaned}', 
-                    label_list=get_children_of_label(tallsorts['clf'].subtypeObjects, level))
+                    label_list=get_children_of_label(tallsorts['clf'], level))
     
     message("Finished. Thanks for using TALLSorts!")
     sys.exit()
@@ -185,19 +220,77 @@ def run_predictions(ui, tallsorts):
 The following are functions used in the process of classifying objects
 """
 
+def run_chunked_predict(tallsorts, samples, chunk_size=10000):
+    """
+    Run tallsorts.predict over chunks of samples and merge the per-level results.
+
+    Very large cohorts are split so each underlying predict_proba call sees at most
+    chunk_size rows, bounding the memory used by the scaled matrices while still
+    keeping each call fully vectorized.
+
+    TMM norm factors are always computed once on the full cohort and used at every
+    hierarchy level, so results do not depend on chunking or on how samples are
+    routed to deeper levels. (Note this differs from older releases, which
+    renormalised the routed subset at levels 2 and below.)
+
+    Parameters
+    __________
+    tallsorts : TALLSorts pipeline object
+    samples : Pandas DataFrame
+        Raw counts with samples as rows and genes as columns.
+    chunk_size : int
+        Maximum number of samples per prediction call.
+
+    Returns
+    __________
+    The classifier results object, with self.levels covering all samples.
+    """
+
+    # TMM norm factors depend on the composition of the batch they are computed
+    # from, so compute them once on the full cohort and use them everywhere: for
+    # every chunk and at every hierarchy level. The un-chunked path gets the same
+    # factors, so both paths produce identical results for the same input.
+    norm_factors = computeNormFactors(samples)
+
+    if samples.shape[0] <= chunk_size:
+        return tallsorts.predict(samples, norm_factors=norm_factors)
+
+    merged = {}
+    for start in range(0, samples.shape[0], chunk_size):
+        chunk = samples.iloc[start:start+chunk_size]
+        results = tallsorts.predict(chunk, norm_factors=norm_factors)
+        # predict overwrites results.levels on every call, so copy the pieces out
+        for level in results.levels:
+            if not results.levels[level]:
+                continue
+            if level not in merged:
+                merged[level] = {'probs_raw_df':[], 'probs_adj_df':[], 'calls_df':[], 'multi_calls':{}}
+            merged[level]['probs_raw_df'].append(results.levels[level]['probs_raw_df'])
+            merged[level]['probs_adj_df'].append(results.levels[level]['probs_adj_df'])
+            merged[level]['calls_df'].append(results.levels[level]['calls_df'])
+            merged[level]['multi_calls'].update(results.levels[level]['multi_calls'])
+
+    results.levels = {level:{'probs_raw_df':pd.concat(merged[level]['probs_raw_df']),
+                             'probs_adj_df':pd.concat(merged[level]['probs_adj_df']),
+                             'calls_df':pd.concat(merged[level]['calls_df']),
+                             'multi_calls':merged[level]['multi_calls']} for level in merged}
+    return results
+
 def gen_multicall_csv(multi_calls, sample_order, path):
     if not multi_calls:
         return None
     max_multicall = max([len(multi_calls[i]) for i in multi_calls])
-    with open(path, 'w') as f:
-        csvwriter = csv.writer(f, delimiter=',')
-        csvwriter.writerow(['']+[i for j in [[f'call_{k+1}', 'proba'] for k in range(max_multicall)] for i in j])
-        for sample in sample_order:
-            to_write = [sample]
-            for call in multi_calls[sample]:
-                to_write += [call[0], round(call[1],3)]
-            to_write += ['' for i in range(2*max_multicall-len(to_write))]
-            csvwriter.writerow(to_write)
+    header = ['']+[i for j in [[f'call_{k+1}', 'proba'] for k in range(max_multicall)] for i in j]
+    # build all rows up front and write them in one to_csv call rather than
+    # paying per-row csv.writer overhead
+    rows = []
+    for sample in sample_order:
+        to_write = [sample]
+        for call in multi_calls[sample]:
+            to_write += [call[0], round(call[1],3)]
+        to_write += [''] * (len(header)-len(to_write))
+        rows.append(to_write)
+    pd.DataFrame(rows, columns=header).to_csv(path, index=False)
     return None
 
 def get_figures(results_level, destination, label_list, plots=["prob_scatter", "waterfalls"]):
@@ -282,35 +375,38 @@ def gen_sample_wise_prob_plot(probs_raw_df, calls_df, label_list, labelThreshDic
 
     jitter = 0.5
     n_samples = len(probs_raw_df.index)
+    n_labels = len(label_list)
+
+    # extract everything once as numpy arrays; per-sample df.loc lookups are far too slow for large cohorts
+    probs_arr = probs_raw_df[label_list].to_numpy()
+    sample_ids = probs_raw_df.index.to_numpy()
+    calls_aligned = calls_df.loc[probs_raw_df.index]
+    y_pred_arr = calls_aligned['y_pred'].to_numpy()
+    y_high_arr = calls_aligned['y_highest'].to_numpy()
+    label_set = set(label_list)
 
     fig = go.Figure()
 
+    bar_x = list(range(n_labels))
     for i in range(n_samples):
-        sample = probs_raw_df.index[i]
-        sample_row = probs_raw_df.loc[sample]
-        x = list(range(len(sample_row.index)))
-        y = sample_row.to_list()
-        customdata = [[sample, i] for i in sample_row.index]
-        fig.add_trace(go.Bar(x=x, y=y, width=0.9, 
+        sample = sample_ids[i]
+        y = probs_arr[i].tolist()
+        customdata = [[sample, label] for label in label_list]
+        fig.add_trace(go.Bar(x=bar_x, y=y, width=0.9,
                             marker={'color':'#90ee90'}, showlegend=False, visible=False,
                             customdata=customdata, hovertemplate='ID: %{customdata[0]}<br>%{customdata[1]}: %{y}<extra></extra>'))
-    
+
     # add other points
-    x = []
-    y = []
-    colour = []
+    x = np.tile(np.arange(n_labels), n_samples) + (np.random.random(n_samples*n_labels)-0.5)*jitter
+    y = probs_arr.ravel()
+    colour = ['black'] * (n_samples*n_labels)
     customdata = []
     for sample_no in range(n_samples):
-        sample = probs_raw_df.index[sample_no]
-        for label_no in range(len(label_list)):
-            label_test = label_list[label_no]
-            x.append(label_no + (np.random.random()-0.5)*jitter)
-            y.append(probs_raw_df.loc[sample][label_test])
-            colour.append('black')
-            if calls_df.loc[sample]['y_pred'] in label_list:
-                customdata.append([f'ID: {sample}<br>Call: {calls_df.loc[sample]["y_pred"]}<extra></extra>'])
-            else:
-                customdata.append([f'ID: {sample}<br>Call: {calls_df.loc[sample]["y_pred"]}<br>Highest: {calls_df.loc[sample]["y_highest"]}<extra></extra>'])
+        if y_pred_arr[sample_no] in label_set:
+            hover = f'ID: {sample_ids[sample_no]}<br>Call: {y_pred_arr[sample_no]}<extra></extra>'
+        else:
+            hover = f'ID: {sample_ids[sample_no]}<br>Call: {y_pred_arr[sample_no]}<br>Highest: {y_high_arr[sample_no]}<extra></extra>'
+        customdata += [[hover]] * n_labels
 
     fig.add_trace(go.Scatter(x=x, y=y,  mode="markers", marker={'color':colour, 'size':4}, visible=True, showlegend=False,
                             customdata=customdata, hovertemplate='%{customdata[0]}<extra></extra>'))
@@ -323,11 +419,16 @@ def gen_sample_wise_prob_plot(probs_raw_df, calls_df, label_list, labelThreshDic
                         line=dict(color="black", width=2), visible=True)
 
     # add dropdown
+    # build the per-button visibility masks as one boolean matrix; constructing a
+    # fresh comparison list per sample is O(n_samples^2) in Python
+    vis = np.zeros((n_samples, n_samples+1), dtype=bool)
+    np.fill_diagonal(vis, True)
+    vis[:, -1] = True
     fig.update_layout(
         updatemenus=[{
             'active':0,
-            'buttons': [{'args':[{'visible':[False for j in range(n_samples)] + [True]}], 'label':'None', 'method':'update'}]
-                    +[{'args':[{'visible':[j == i for j in range(n_samples)] + [True]}], 'label':probs_raw_df.index[i], 'method':'update'} for i in range(n_samples)],
+            'buttons': [{'args':[{'visible':[False]*n_samples + [True]}], 'label':'None', 'method':'update'}]
+                    +[{'args':[{'visible':vis[i].tolist()}], 'label':sample_ids[i], 'method':'update'} for i in range(n_samples)],
             'direction':'down',
             'pad':{"r": 10, "t": 10},
             'showactive':True,
@@ -389,32 +490,48 @@ def gen_waterfall_distribution(calls_df, label_list, labelThreshDict=None, batch
     label_list_unclassified = label_list + ['Unclassified']
     label_colours = get_colours_for_labels(label_list_unclassified)
 
+    label_rank = {label:i for i, label in enumerate(label_list_unclassified)}
+
     waterfallDf = calls_df.copy()
     waterfallDf.sort_values('proba_adj', inplace=True, ascending=False)
-    waterfallDf.sort_values('y_pred', inplace=True, kind='stable', key=lambda x: pd.Series([label_list_unclassified.index(y) for y in x]))
-    waterfallDf['colour'] = waterfallDf['y_pred'].apply(lambda x:label_colours[x])
+    waterfallDf.sort_values('y_pred', inplace=True, kind='stable', key=lambda x: x.map(label_rank))
+    waterfallDf['colour'] = waterfallDf['y_pred'].map(label_colours)
     waterfallDf['sample_id'] = waterfallDf.index
     fig = go.Figure()
 
-    x = 0
-    for sample in waterfallDf.index:
-        sample_row = waterfallDf.loc[sample]
-        if sample_row["y_pred"] == 'Unclassified':
-            hovertemplate = f'ID: {sample}<br>Call: {sample_row["y_pred"]}<br>Highest call: {sample_row["y_highest"]}<extra></extra>'
-        else:
-            hovertemplate = f'ID: {sample}<br>Call: {sample_row["y_pred"]}<extra></extra>'
-        fig.add_trace(go.Bar(x=[x], y=[sample_row['proba_raw']], width=0.9, 
-                            marker={'color':sample_row['colour']}, showlegend=False,
-                            hovertemplate=hovertemplate))
-        if sample_row['y_pred'] in label_list:
-            fig.add_shape(type="line",
-                        x0=x-0.4, y0=labelThreshDict[sample_row['y_pred']],
-                        x1=x+0.4, y1=labelThreshDict[sample_row['y_pred']],
-                        line=dict(color="black", width=2))
-        x += 1
+    # one vectorized Bar trace instead of one trace per sample; trace count (and the
+    # serialized JSON payload) stays O(1) regardless of cohort size
+    xs = np.arange(len(waterfallDf))
+    ys = waterfallDf['proba_raw'].to_numpy()
+    colours = waterfallDf['colour'].to_numpy()
+    y_pred_arr = waterfallDf['y_pred'].to_numpy()
+    y_high_arr = waterfallDf['y_highest'].to_numpy()
+    hovertemplates = [f'ID: {sample}<br>Call: {y_pred}<br>Highest call: {y_high}<extra></extra>'
+                      if y_pred == 'Unclassified' else
+                      f'ID: {sample}<br>Call: {y_pred}<extra></extra>'
+                      for sample, y_pred, y_high in zip(waterfallDf.index, y_pred_arr, y_high_arr)]
+    fig.add_trace(go.Bar(x=xs, y=ys, width=0.9,
+                        marker={'color':colours}, showlegend=False,
+                        hovertemplate=hovertemplates))
+
+    # threshold lines: one Scatter per subtype with None-separated segments,
+    # rather than one shape per classified sample
+    for label in label_list:
+        label_xs = xs[y_pred_arr == label]
+        if len(label_xs) == 0:
+            continue
+        thresh = labelThreshDict[label]
+        line_x = []
+        line_y = []
+        for x in label_xs:
+            line_x += [x-0.4, x+0.4, None]
+            line_y += [thresh, thresh, None]
+        fig.add_trace(go.Scatter(x=line_x, y=line_y, mode='lines',
+                                line=dict(color="black", width=2),
+                                showlegend=False, hoverinfo='skip'))
 
     # custom legend
-    for label in sorted(label_colours.keys(), key=lambda x:label_list_unclassified.index(x)):
+    for label in sorted(label_colours.keys(), key=label_rank.get):
         fig.add_trace(go.Bar(x=[None], y=[None], marker={'color':label_colours[label]}, showlegend=True, name=label))
     
     fig.update_xaxes(title_text='Samples', showgrid=False, showticklabels=False)
@@ -460,33 +577,42 @@ def convert_symbols_to_ensembl(symb_list, path=False):
 
     # generate a pyensembl genome object
     from pyensembl import EnsemblRelease
+    from collections import defaultdict
     ensembl_data = EnsemblRelease(110)
 
+    # pull the whole gene_name -> gene_id mapping out of SQLite in one query, then
+    # resolve symbols in memory; per-symbol genes_by_name calls add up to tens of
+    # thousands of database round-trips
+    name_map = defaultdict(list)
+    for gene_name, gene_id in ensembl_data.db.run_sql_query("SELECT gene_name, gene_id FROM gene"):
+        name_map[gene_name].append(gene_id)
+
     confirmed = {}
     unconfirmed = []
     nonexistent = []
     for i in symb_list:
-        try:
-            z = ensembl_data.genes_by_name(i.upper())
-            if len(z) == 1:
-                confirmed[i] = z[0].gene_id
-            else:
-                unconfirmed.append(i)
-        except:
+        z = name_map.get(i.upper(), [])
+        if len(z) == 1:
+            confirmed[i] = z[0]
+        elif z:
+            unconfirmed.append(i)
+        else:
             nonexistent.append(i)
-            continue
-    
+
     # process of elimination
     fixed = 1
     message(f'Unconfirmed: {len(unconfirmed)}')
+    used = set(confirmed.values())
     while fixed > 0:
         fixed = 0
         unconfirmed2 = []
         for i in unconfirmed:
-            z = ensembl_data.genes_by_name(i.upper())
-            y = [i for i in z if i not in confirmed.values()]
+            # candidate IDs not already assigned to another symbol; the set keeps
+            # each membership test O(1) instead of scanning confirmed.values()
+            y = [g for g in name_map[i.upper()] if g not in used]
             if len(y) == 1:
                 confirmed[i] = y[0]
+                used.add(y[0])
                 fixed += 1
             else:
                 unconfirmed2.append(i)
@@ -496,16 +622,20 @@ def convert_symbols_to_ensembl(symb_list, path=False):
     message(f'Ensembl IDs found for {len(confirmed)} out of {len(symb_list)} genes.')
     return {'confirmed':confirmed, 'unconfirmed':unconfirmed}
 
-def get_children_of_label(subtypeObjects, label_name):
+def get_children_of_label(clf, label_name):
     # A label name of the form "Level_num_parent"
     label_name_components = label_name.split('_')
     level_num = int(label_name_components[1])
     parent_label = '_'.join(label_name_components[2:])
 
+    # models pickled before the children index existed won't carry these attributes
+    if not hasattr(clf, 'children_map'):
+        clf.level1_labels = sorted([i for i in clf.subtypeObjects if clf.subtypeObjects[i].level == 1])
+        clf.children_map = {label: [c.label for c in clf.subtypeObjects[label].children] for label in clf.subtypeObjects}
+
     if level_num == 1:
-        return sorted([i for i in subtypeObjects if subtypeObjects[i].level == 1])
-    parent_obj = subtypeObjects[parent_label]
-    return [i.label for i in parent_obj.children]
+        return clf.level1_labels
+    return clf.children_map[parent_label]
 
 def clean_label(label):
     label = str(label)
@@ -553,11 +683,8 @@ def get_colours_for_labels(label_list, use_default=True):
     if unaccounted_labels:
         import colorsys
         def rgb_to_hex(rgb):
-            hex_code = '#'
-            hex_raw = [hex(int(i*255))[2:].upper() for i in rgb]
-            for i in hex_raw:
-                hex_code += '0'+i if len(i)<2 else i
-            return hex_code
+            r, g, b = (int(v*255) for v in rgb)
+            return f'#{r:02X}{g:02X}{b:02X}'
         
         unaccounted_hues = [rgb_to_hex(colorsys.hsv_to_rgb(i,1,1)) for i in np.linspace(0,1,len(unaccounted_labels)+1)]
         for i in range(len(unaccounted_labels)):
@@ -582,53 +709,92 @@ def fit_classifier(ui, n_jobs=1):
     subtypeObjects = genSubtypeObjsFromHierarchy(hierarchy)
     check_training_inputs(X, sample_sheet, subtypeObjects)
     logreg_params = gen_logreg_params(training_params, subtypeObjects)
-    scalers = {}
     clfs = {}
 
     message("Training classifier. This could take some time...")
 
-    ### creating the scalers
-    ###
-
-    def create_scalers(X, parent_label, filter=True):
-        if parent_label == 'Level0':
-            children_labels = [i for i in subtypeObjects if subtypeObjects[i].level == 1]
-        else:
+    # dump the counts matrix to a joblib memmap once; loky workers then share the
+    # read-only array instead of each unpickling their own copy of the DataFrame
+    mmap_dir = tempfile.mkdtemp(prefix='tallsorts_')
+    try:
+        mmap_path = os.path.join(mmap_dir, 'X.mmap')
+        joblib.dump(X.to_numpy(), mmap_path)
+        X_mm = joblib.load(mmap_path, mmap_mode='r')
+        sample_index = X.index
+        gene_columns = X.columns
+        row_positions = {sample: i for i, sample in enumerate(sample_index)}
+
+        # many labels share a parent, so the per-parent sample membership and the
+        # per-label truth vectors are computed once here rather than rebuilt from the
+        # sample sheet inside every worker
+        parent_labels = ['Level0'] + sorted([i for i in subtypeObjects if subtypeObjects[i].children], key=lambda x:subtypeObjects[x].level)
+        parent_rows = {'Level0': np.arange(len(sample_index))}
+        for parent_label in parent_labels[1:]:
             subset_samples = sample_sheet.index[sample_sheet[parent_label] == 1]
-            X = X.loc[subset_samples]
-            children_labels = [i.label for i in subtypeObjects[parent_label].children]
+            parent_rows[parent_label] = np.array([row_positions[sample] for sample in subset_samples], dtype=int)
+        y_by_label = {label: (sample_sheet[label].reindex(sample_index).to_numpy() == 1) for label in subtypeObjects}
 
-        if filter:
-            min_subtype = min([sum(sample_sheet.loc[X.index][label] == 1) for label in children_labels])
-            X = X[filter_genes(X, min_subtype)]
-        scalers[parent_label] = createScaler(X)
-    
-    parent_labels = ['Level0'] + sorted([i for i in subtypeObjects if subtypeObjects[i].children], key=lambda x:subtypeObjects[x].level)
-    with parallel_backend('threading', n_jobs=n_jobs):
-        Parallel(verbose=0)(delayed(create_scalers)(X, parent_label, filter=ui.filter) for parent_label in parent_labels)
+        ### creating the scalers
+        ###
 
-    ### performing model training
-    ###
-
-    def performing_training(X, label, logreg_params):
-        # training model (note this is specific to label)
-        parent_label = subtypeObjects[label].parent.label if subtypeObjects[label].parent else 'Level0'
-        if parent_label != 'Level0':
-            subset_samples = sample_sheet.index[sample_sheet[parent_label] == 1]
-            X_subset = X.loc[subset_samples]
-        else:
-            X_subset = X.copy()
-        scaler = scalers[parent_label]
-        X_train = scaleForTesting(X_subset, scaler)
-        y_train = sample_sheet.loc[X_train.index][label] == 1
-        # logreg_params: random_state=0, max_iter=10000, tol=0.0001, penalty='l1', solver='saga', C=0.2, class_weight='balanced'
-        logreg = LogisticRegression(**logreg_params)
-        clf = logreg.fit(X_train, y_train)
-        subtypeObjects[label].clf = clf
-        message(f'Trained label {label}')
-
-    with parallel_backend('threading', n_jobs=n_jobs):
-        Parallel(verbose=1)(delayed(performing_training)(X, label, logreg_params[label]) for label in subtypeObjects)
+        def create_scalers(X_mm, parent_label, filter=True):
+            rows = parent_rows[parent_label]
+            if parent_label == 'Level0':
+                children_labels = [i for i in subtypeObjects if subtypeObjects[i].level == 1]
+                X = pd.DataFrame(np.asarray(X_mm), index=sample_index, columns=gene_columns)
+            else:
+                X = pd.DataFrame(X_mm[rows], index=sample_index[rows], columns=gene_columns)
+                children_labels = [i.label for i in subtypeObjects[parent_label].children]
+
+            if filter:
+                min_subtype = min([int(y_by_label[label][rows].sum()) for label in children_labels])
+                X = X[filter_genes(X, min_subtype)]
+            return parent_label, createScaler(X)
+
+        with parallel_backend('loky', n_jobs=n_jobs):
+            scalers = dict(Parallel(verbose=0)(delayed(create_scalers)(X_mm, parent_label, filter=ui.filter) for parent_label in parent_labels))
+
+        ### scaling each parent's submatrix once, shared by all of its child labels
+        ###
+
+        label_parent = {label: (subtypeObjects[label].parent.label if subtypeObjects[label].parent else 'Level0') for label in subtypeObjects}
+        X_scaled_mm = {}
+        scaled_columns = {}
+        for parent_label in parent_labels:
+            rows = parent_rows[parent_label]
+            if parent_label == 'Level0':
+                X_subset = pd.DataFrame(np.asarray(X_mm), index=sample_index, columns=gene_columns)
+            else:
+                X_subset = pd.DataFrame(X_mm[rows], index=sample_index[rows], columns=gene_columns)
+            X_scaled = scaleForTesting(X_subset, scalers[parent_label])
+            scaled_columns[parent_label] = X_scaled.columns
+            scaled_path = os.path.join(mmap_dir, f'X_scaled_{clean_label(parent_label)}.mmap')
+            joblib.dump(X_scaled.to_numpy(), scaled_path)
+            X_scaled_mm[parent_label] = joblib.load(scaled_path, mmap_mode='r')
+
+        ### performing model training
+        ###
+
+        def performing_training(X_scaled, label, logreg_params):
+            # training model (note this is specific to label)
+            parent_label = label_parent[label]
+            rows = parent_rows[parent_label]
+            X_train = pd.DataFrame(np.asarray(X_scaled), index=sample_index[rows], columns=scaled_columns[parent_label])
+            y_train = y_by_label[label][rows]
+            # logreg_params: random_state=0, max_iter=10000, tol=0.0001, penalty='l1', solver='saga', C=0.2, class_weight='balanced'
+            logreg = LogisticRegression(**logreg_params)
+            clf = logreg.fit(X_train, y_train)
+            message(f'Trained label {label}')
+            return label, clf
+
+        with parallel_backend('loky', n_jobs=n_jobs):
+            trained = Parallel(verbose=1)(delayed(performing_training)(X_scaled_mm[label_parent[label]], label, logreg_params[label]) for label in subtypeObjects)
+        for label, clf in trained:
+            subtypeObjects[label].clf = clf
+    finally:
+        # the scratch directory holds a full copy of X plus one scaled submatrix
+        # per parent; make sure it is removed even when training fails
+        shutil.rmtree(mmap_dir, ignore_errors=True)
 
     ### completing training and saving model
     ###
@@ -720,6 +886,25 @@ def gen_logreg_params(training_params, subtypeObjects):
     
     return logreg_params
 
+# optional numba kernel for the CPM threshold count: fuses the comparison and the
+# per-gene reduction so no boolean matrix the size of X is ever materialized
+try:
+    import numba
+
+    @numba.njit(parallel=True, cache=True)
+    def _count_above(X, thresh):
+        n, m = X.shape
+        out = np.zeros(m, dtype=np.int64)
+        for j in numba.prange(m):
+            c = 0
+            for i in range(n):
+                if X[i, j] >= thresh:
+                    c += 1
+            out[j] = c
+        return out
+except ImportError:
+    numba = None
+
 def filter_genes(X, min_subtype, verbose=False):
     from pyensembl import EnsemblRelease
     ensembl_data = EnsemblRelease(110)
@@ -729,40 +914,48 @@ def filter_genes(X, min_subtype, verbose=False):
         message(f'There are {len(candidate_genes)} genes initially.')
 
     ### Removing genes not in the annotation set
-    not_found = []
+    # query each gene exactly once and keep the object; repeated gene_by_id calls each hit SQLite
+    gene_objs = {}
     for i in candidate_genes:
         try:
-            ensembl_data.gene_by_id(i)
+            gene_objs[i] = ensembl_data.gene_by_id(i)
         except:
-            not_found.append(i)
-    candidate_genes = [i for i in candidate_genes if i not in not_found]
+            pass
+    candidate_genes = [i for i in candidate_genes if i in gene_objs]
     if verbose:
         message(f'Removed genes not in the annotation set. There are now {len(candidate_genes)} genes.')
 
     ### Removing Y-chromosome genes and XIST
-    Y = ensembl_data.gene_ids(contig='Y') + [ensembl_data.genes_by_name('XIST')[0].gene_id]
+    Y = set(ensembl_data.gene_ids(contig='Y')) | {ensembl_data.genes_by_name('XIST')[0].gene_id}
     candidate_genes = [i for i in candidate_genes if i not in Y]
     if verbose:
         message(f'Removed Y-chromosome and XIST genes. There are now {len(candidate_genes)} genes.')
-    
+
     ### Removing noncoding genes and pseudogenes
     categories_to_keep = ['protein_coding']
-    candidate_genes = [i for i in candidate_genes if ensembl_data.gene_by_id(i).biotype in categories_to_keep]
+    candidate_genes = [i for i in candidate_genes if gene_objs[i].biotype in categories_to_keep]
     if verbose:
         message(f'Removed There are {len(candidate_genes)} coding genes remaining.')
 
     ### Removing mitochondrial genes
-    MT = [i for i in candidate_genes if ensembl_data.gene_by_id(i).contig == 'MT']
+    MT = set(ensembl_data.gene_ids(contig='MT'))
     candidate_genes = [i for i in candidate_genes if i not in MT]
     if verbose:
         message(f'Removed mitochondrial genes. There are now {len(candidate_genes)} genes.')
     
     ### Converting to CPM
-    X_cpm = conorm.cpm(X.transpose()).transpose()
-    
+    # plain CPM straight from numpy; no need for conorm or the double transpose here
+    X_arr = X.to_numpy()
+    totals = X_arr.sum(axis=1)
+    X_cpm = X_arr * (1e6 / totals[:, None])
+
     ### Remove all genes that have fewer than 5 counts in fewer samples than the smallest subtype
-    cpm_threshold = 5/min(X.sum(axis=1)) * 1e6
-    to_remain = X.columns[(X_cpm >= cpm_threshold).sum(axis=0) >= min_subtype]
+    cpm_threshold = 5/totals.min() * 1e6
+    if numba is not None:
+        keep_mask = _count_above(X_cpm, cpm_threshold) >= min_subtype
+    else:
+        keep_mask = (X_cpm >= cpm_threshold).sum(axis=0) >= min_subtype
+    to_remain = set(X.columns[keep_mask])
     candidate_genes = [i for i in candidate_genes if i in to_remain]
     if verbose:
         message(f'Candidate genes remaining: {len(candidate_genes)}')